@@ -9,33 +9,253 @@ The tasks for this demo are getting the contents
 of webpages and reading files
 """
 import asyncio
+import codecs
+import re
+from collections import OrderedDict
+from functools import partial
 import aiohttp
 import aiofiles
+import chardet
 from codetiming import Timer
 
 
-async def factorial(number: int):
-    async def inner_factorial(number):
-        if number <= 1:
-            return 1
-        if number % 10 == 0:
-            print("Context switch to event loop")
-            await asyncio.sleep(0)
-        return number * await inner_factorial(number - 1)
-    return await inner_factorial(number)        
+# How much of a body to look at when sniffing for an encoding
+SNIFF_PREFIX_SIZE = 4096
 
+META_CHARSET_RE = re.compile(
+    rb"""<meta[^>]+charset\s*=\s*["']?\s*([a-zA-Z0-9_\-:.]+)""",
+    re.IGNORECASE,
+)
 
-async def io_task_get_web_pages(url: str=""):
+# Byte order marks and the encodings that decode them, longest first
+BOMS = (
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
+# How long to collect cpu_task requests before computing them
+BATCH_WINDOW = 0.01
+
+# How many factorial results to keep around for reuse
+FACTORIAL_CACHE_SIZE = 32
+
+
+class FactorialBatcher:
+    """Collects factorial requests over a short window and
+    computes them together in one incremental pass, smallest
+    number first, so each product is reused for the next one.
+    Results are kept in a bounded LRU cache so later batches
+    can start from the nearest smaller result.
+
+    Args:
+        window (float): Seconds to wait for more requests
+        cache_size (int): The number of results to keep cached
+    """
+    def __init__(self, window: float=BATCH_WINDOW, cache_size: int=FACTORIAL_CACHE_SIZE):
+        self.window = window
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.pending = {}
+        self.flush_task = None
+
+    async def submit(self, number: int):
+        """Requests the factorial of a number, waiting for
+        the batch it lands in to be computed
+
+        Args:
+            number (int): The number to get calculate a factorial for
+        """
+        if number in self.cache:
+            self.cache.move_to_end(number)
+            return self.cache[number]
+        loop = asyncio.get_running_loop()
+        if self.flush_task is not None and self.flush_task.get_loop() is not loop:
+            # the last batch belongs to an event loop that has gone away
+            self.pending, self.flush_task = {}, None
+        future = self.pending.get(number)
+        if future is None:
+            future = loop.create_future()
+            self.pending[number] = future
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush())
+            self.flush_task.add_done_callback(partial(self.flush_done, self.pending))
+        # shield the shared future so one cancelled caller doesn't cancel the rest
+        return await asyncio.shield(future)
+
+    async def flush(self):
+        """Waits out the batch window, then computes every pending request"""
+        await asyncio.sleep(self.window)
+        pending, self.pending = self.pending, {}
+        self.flush_task = None
+        try:
+            await self.compute(pending)
+        except Exception as error:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(error)
+
+    def flush_done(self, pending: dict, flush_task: asyncio.Task):
+        """Cleans up after a batch's flush task finishes. If it was
+        cancelled, even before it started running, the batch is reset
+        and its callers are cancelled instead of waiting forever.
+
+        Args:
+            pending (dict): The futures waiting on each number in the batch
+            flush_task (asyncio.Task): The task that computed the batch
+        """
+        if self.pending is pending:
+            self.pending, self.flush_task = {}, None
+        for future in pending.values():
+            if not future.done():
+                future.cancel()
+
+    async def compute(self, pending: dict):
+        """Computes the factorials for a batch of requests in one pass
+
+        Args:
+            pending (dict): The futures waiting on each number
+        """
+        numbers = sorted(pending)
+        current, product = self.start_point(numbers[0])
+        for number in numbers:
+            while current < number:
+                current += 1
+                product *= current
+                if current % 10 == 0:
+                    print("Context switch to event loop")
+                    await asyncio.sleep(0)
+            self.cache_result(number, product)
+            if not pending[number].done():
+                pending[number].set_result(product)
+
+    def start_point(self, number: int):
+        """Returns the largest cached (number, factorial) pair
+        that isn't bigger than the number, or (1, 1)
+
+        Args:
+            number (int): The smallest number in the batch
+        """
+        start = max((key for key in self.cache if key <= number), default=None)
+        if start is None:
+            return 1, 1
+        return start, self.cache[start]
+
+    def cache_result(self, number: int, result: int):
+        """Adds a result to the cache, evicting the least recently used
+
+        Args:
+            number (int): The number the factorial was calculated for
+            result (int): The factorial of the number
+        """
+        self.cache[number] = result
+        self.cache.move_to_end(number)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+
+factorial_batcher = FactorialBatcher()
+
+
+def valid_encoding(encoding):
+    """Returns the normalized codec name for an encoding,
+    or None if Python doesn't know about it or it isn't
+    a text encoding (like hex or zlib)
+
+    Args:
+        encoding (str): The encoding name to check
+    """
+    if not encoding:
+        return None
+    try:
+        name = codecs.lookup(encoding).name
+        # bytes.decode() refuses codecs that don't produce text
+        b"a".decode(name, errors="ignore")
+    except (LookupError, UnicodeError):
+        return None
+    return name
+
+
+def bom_encoding(body: bytes):
+    """Returns the encoding given by a byte order mark at
+    the start of the body, or None if there isn't one
+
+    Args:
+        body (bytes): The raw body to check
+    """
+    for bom, encoding in BOMS:
+        if body.startswith(bom):
+            return encoding
+    return None
+
+
+def sniff_encoding(body: bytes):
+    """Works out the encoding of a body that arrived without
+    a charset header. Only a bounded prefix of the body is
+    examined so large pages don't cost much cpu time.
+
+    Args:
+        body (bytes): The raw body to sniff
+    """
+    prefix = body[:SNIFF_PREFIX_SIZE]
+    match = META_CHARSET_RE.search(prefix)
+    if match:
+        encoding = valid_encoding(match.group(1).decode("ascii", "ignore"))
+        # a meta tag that could be read as ascii can't really be utf-16 or utf-32
+        if encoding is not None and encoding.startswith(("utf-16", "utf-32")):
+            return "utf-8"
+        if encoding is not None:
+            return encoding
+    try:
+        # a multi-byte character may be cut off at the end of the prefix
+        prefix.decode("utf-8")
+        return "utf-8"
+    except UnicodeDecodeError as error:
+        if error.reason == "unexpected end of data" and len(body) > len(prefix):
+            return "utf-8"
+    return valid_encoding(chardet.detect(prefix)["encoding"]) or "utf-8"
+
+
+def decode_body(body: bytes, charset: str=None):
+    """Decodes a body using its byte order mark, then the header
+    charset, then the html meta charset, then detection on a
+    prefix of the body. If
+    the rest of the body doesn't match, detection is run again
+    on the part of the body around the first bad byte.
+
+    Args:
+        body (bytes): The raw body to decode
+        charset (str): The charset from the Content-Type header, if any
+    """
+    encoding = bom_encoding(body) or valid_encoding(charset) or sniff_encoding(body)
+    try:
+        return body.decode(encoding)
+    except UnicodeDecodeError as error:
+        start = max(error.start - SNIFF_PREFIX_SIZE // 2, 0)
+        window = body[start:start + SNIFF_PREFIX_SIZE]
+        fallback = valid_encoding(chardet.detect(window)["encoding"]) or "cp1252"
+    try:
+        return body.decode(fallback)
+    except UnicodeDecodeError:
+        return body.decode(fallback, errors="replace")
+
+
+async def io_task_get_web_pages(url: str="", decode: bool=True):
     """This is a little task that takes some time to complete
 
     Args:
         url (str): The url to get via http
+        decode (bool): Decode the body to text, or keep it as bytes
     """
     with Timer(text="Task elapsed time: {:.2f} seconds"):
         async with aiohttp.ClientSession() as session:
             async with session.get(url) as response:
-                text = await response.text()
-                return url, text
+                body = await response.read()
+                if not decode:
+                    return url, body
+                return url, decode_body(body, response.charset)
 
 
 async def io_task_read_file(filename: str=""):
@@ -59,7 +279,7 @@ async def cpu_task(number: int):
         number (int): The number to get calculate a factorial for
     """
     with Timer(text="CPU Task elapsed time: {:.2f} seconds"):
-        result = await factorial(number)
+        result = await factorial_batcher.submit(number)
         return result
 
 
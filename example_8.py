@@ -0,0 +1,305 @@
+"""This is a bonus example program demonstrating a asynchronous
+approach to accomplishing tasks. In this version the workers
+crawl a website instead of getting a fixed list of webpages.
+
+Each page body is parsed as its chunks arrive, the links found
+are normalized and checked against a compact seen set, and new
+links are put back on the task queue until the depth limit is
+reached. Because the workers add tasks to the queue as they run,
+they wait on the queue and main() waits for it to be drained.
+"""
+import asyncio
+import codecs
+import hashlib
+import re
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urldefrag, urlsplit, urlunsplit
+import aiohttp
+from codetiming import Timer
+
+
+# How much of a body to read at a time
+CHUNK_SIZE = 16 * 1024
+
+# How many links deep to crawl from the starting page
+MAX_DEPTH = 2
+
+# Stop reading a page once this many new links have been queued from it
+MAX_LINKS_PER_PAGE = 50
+
+META_CHARSET_RE = re.compile(
+    rb"""<meta[^>]+charset\s*=\s*["']?\s*([a-zA-Z0-9_\-:.]+)""",
+    re.IGNORECASE,
+)
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# Byte order marks and the encodings that decode them, longest first
+BOMS = (
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
+
+def normalize_url(url: str):
+    """Returns a normalized form of a url so the same page
+    is only seen once, or None if it isn't an http(s) url
+
+    Args:
+        url (str): The absolute url to normalize
+    """
+    url, _ = urldefrag(url.strip())
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return None
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS or not parts.hostname:
+        return None
+    netloc = parts.hostname.lower()
+    if ":" in netloc:
+        # hostname drops the brackets around ipv6 addresses
+        netloc = f"[{netloc}]"
+    if port is not None and port != DEFAULT_PORTS[scheme]:
+        netloc = f"{netloc}:{port}"
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, ""))
+
+
+def valid_encoding(encoding):
+    """Returns the normalized codec name for an encoding,
+    or None if Python doesn't know about it or it isn't
+    a text encoding (like hex or zlib)
+
+    Args:
+        encoding (str): The encoding name to check
+    """
+    if not encoding:
+        return None
+    try:
+        name = codecs.lookup(encoding).name
+        # bytes.decode() refuses codecs that don't produce text
+        b"a".decode(name, errors="ignore")
+    except (LookupError, UnicodeError):
+        return None
+    return name
+
+
+def get_decoder(charset: str, first_chunk: bytes):
+    """Returns an incremental decoder for a body using its byte
+    order mark, then the header charset, then the html meta
+    charset in the first chunk, then utf-8
+
+    Args:
+        charset (str): The charset from the Content-Type header, if any
+        first_chunk (bytes): The first chunk of the body
+    """
+    encoding = next((name for bom, name in BOMS if first_chunk.startswith(bom)), None)
+    encoding = encoding or valid_encoding(charset)
+    if encoding is None:
+        match = META_CHARSET_RE.search(first_chunk)
+        if match:
+            encoding = valid_encoding(match.group(1).decode("ascii", "ignore"))
+            # a meta tag that could be read as ascii can't really be utf-16 or utf-32
+            if encoding is not None and encoding.startswith(("utf-16", "utf-32")):
+                encoding = "utf-8"
+    return codecs.getincrementaldecoder(encoding or "utf-8")(errors="replace")
+
+
+class SeenUrls:
+    """A compact set of urls that have been seen. Only an
+    8 byte hash of each url is kept instead of the url itself.
+    """
+    def __init__(self):
+        self.hashes = set()
+
+    @staticmethod
+    def url_hash(url: str):
+        """Returns the 8 byte hash of a url as an int"""
+        return int.from_bytes(hashlib.blake2b(url.encode(), digest_size=8).digest(), "big")
+
+    def add(self, url: str):
+        """Adds a url, returning True if it wasn't seen before
+
+        Args:
+            url (str): The normalized url to add
+        """
+        url_hash = self.url_hash(url)
+        if url_hash in self.hashes:
+            return False
+        self.hashes.add(url_hash)
+        return True
+
+    def __len__(self):
+        return len(self.hashes)
+
+
+class LinkParser(HTMLParser):
+    """A streaming html parser that collects the links
+    in a page as chunks of it are fed in
+
+    Args:
+        base_url (str): The url of the page being parsed
+    """
+    def __init__(self, base_url: str):
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in ("a", "base"):
+            return
+        href = dict(attrs).get("href")
+        if not href:
+            return
+        if tag == "base":
+            self.base_url = urljoin(self.base_url, href)
+            return
+        link = normalize_url(urljoin(self.base_url, href))
+        if link is not None:
+            self.links.append(link)
+
+    def take_links(self):
+        """Returns the links found since the last call"""
+        links, self.links = self.links, []
+        return links
+
+
+class Crawler:
+    """Crawls the pages of a site, putting each new link it
+    finds back on the task queue until the depth limit
+
+    Args:
+        session (aiohttp.ClientSession): The session the pages are fetched with
+        task_queue (asyncio.Queue): The queue the tasks are put on
+        max_depth (int): How many links deep to crawl
+    """
+    def __init__(self, session: aiohttp.ClientSession, task_queue: asyncio.Queue, max_depth: int=MAX_DEPTH):
+        self.session = session
+        self.task_queue = task_queue
+        self.max_depth = max_depth
+        self.seen = SeenUrls()
+        self.pages_crawled = 0
+
+    def add_url(self, url: str, depth: int=0):
+        """Puts a crawl task on the queue for a url that hasn't been seen,
+        returning True if it was queued
+
+        Args:
+            url (str): The url to crawl
+            depth (int): How many links the url is from the starting page
+        """
+        url = normalize_url(url)
+        if url is not None and depth <= self.max_depth and self.seen.add(url):
+            self.task_queue.put_nowait((self.io_task_crawl_page, {"url": url, "depth": depth}))
+            return True
+        return False
+
+    def add_links(self, links: list, host: str, depth: int):
+        """Queues the links that stay on the site being crawled,
+        returning how many of them were queued
+
+        Args:
+            links (list): The links found on a page
+            host (str): The host of the site being crawled
+            depth (int): How many links the links are from the starting page
+        """
+        return sum(
+            self.add_url(link, depth)
+            for link in links
+            if urlsplit(link).hostname == host
+        )
+
+    async def io_task_crawl_page(self, url: str="", depth: int=0):
+        """This is a little task that takes some time to complete
+
+        Args:
+            url (str): The url to get via http
+            depth (int): How many links the url is from the starting page
+        """
+        with Timer(text="Task elapsed time: {:.2f} seconds"):
+            links_queued = 0
+            async with self.session.get(url) as response:
+                if response.content_type != "text/html":
+                    return url, links_queued
+                self.pages_crawled += 1
+                # links on the deepest pages would never be queued, so don't read them
+                if depth >= self.max_depth:
+                    return url, links_queued
+                # follow redirects to the page's final url
+                final_url = normalize_url(str(response.url))
+                if final_url is None:
+                    return url, links_queued
+                self.seen.add(final_url)
+                host = urlsplit(final_url).hostname
+                parser = LinkParser(str(response.url))
+                decoder = None
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    if decoder is None:
+                        decoder = get_decoder(response.charset, chunk)
+                    parser.feed(decoder.decode(chunk))
+                    links_queued += self.add_links(parser.take_links(), host, depth + 1)
+                    if links_queued >= MAX_LINKS_PER_PAGE:
+                        break
+                if decoder is not None:
+                    parser.feed(decoder.decode(b"", final=True))
+                parser.close()
+                # closing the parser can emit a link from its buffered data
+                links_queued += self.add_links(parser.take_links(), host, depth + 1)
+                return url, links_queued
+
+
+async def worker(name: str, task_queue: asyncio.Queue):
+    """This is our worker that pulls tasks from
+    the queue and performs them
+
+    Args:
+        name (str): The string name of the task
+        task_queue (asyncio.Queue): The queue the tasks are pulled from
+    """
+    # pull tasks from the queue until the worker is cancelled
+    print(f"Worker {name} starting to run tasks")
+    while True:
+        fn, kwargs = await task_queue.get()
+        try:
+            url, links_queued = await fn(**kwargs)
+            print(f"Worker {name} completed task: {url=}, {links_queued=}\n")
+        except Exception as error:
+            # a bad page shouldn't stop the worker, or join() would wait forever
+            print(f"Worker {name} failed task: url={kwargs['url']!r}, {error=}\n")
+        finally:
+            task_queue.task_done()
+
+
+async def main():
+    """
+    This is the main entry point for the program
+    """
+    # Create the queue for tasks
+    task_queue = asyncio.Queue()
+
+    with Timer(text="Total elapsed time: {:.2f}"):
+        async with aiohttp.ClientSession() as session:
+            crawler = Crawler(session, task_queue)
+
+            # Put the starting page in the queue
+            crawler.add_url("https://www.python.org/")
+
+            workers = [
+                asyncio.create_task(worker("One", task_queue)),
+                asyncio.create_task(worker("Two", task_queue)),
+            ]
+            await task_queue.join()
+            for worker_ in workers:
+                worker_.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            print(f"Crawled {crawler.pages_crawled} pages")
+
+
+if __name__ == "__main__":
+    print()
+    asyncio.run(main())
+    print()